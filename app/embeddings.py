@@ -1,93 +1,623 @@
 import os
+import asyncio
+import contextlib
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from dataclasses import dataclass, field
+from functools import lru_cache
 import faiss
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict, Any
-import json
+from typing import List, Tuple, Dict, Any, Optional
+import orjson
+
+logger = logging.getLogger(__name__)
 
 # 1) Load an embedding model (once, at startup)
-EMBED_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+#    On a CUDA machine: PyTorch on the GPU in float16.
+#    Otherwise the default is the ONNX Runtime backend with the int8-quantized
+#    graph published alongside the checkpoint (optimum-cli -O4 + avx512_vnni
+#    quantization), so no re-export happens at load time.
+#    EMBED_BACKEND=torch on CPU runs PyTorch in bfloat16 instead (halves the
+#    bytes through every matmul; fast on CPUs with AVX512-BF16/AMX).
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch" if DEVICE == "cuda" else "onnx")
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+EMBED_TORCH_DTYPE = os.getenv("EMBED_TORCH_DTYPE", "float16" if DEVICE == "cuda" else "bfloat16")
+
+def _load_embed_model() -> SentenceTransformer:
+    if EMBED_BACKEND == "onnx":
+        return SentenceTransformer(
+            EMBED_MODEL_NAME,
+            backend="onnx",
+            model_kwargs={"provider": "CPUExecutionProvider", "file_name": EMBED_ONNX_FILE},
+        )
+    # encode(convert_to_numpy=True) only upcasts bfloat16 (numpy has no such
+    # dtype); float16 comes back as a float16 ndarray, so the float32 casts in
+    # embed_and_store and _encode_query are required, not cosmetic.
+    return SentenceTransformer(
+        EMBED_MODEL_NAME,
+        device=DEVICE,
+        model_kwargs={"torch_dtype": EMBED_TORCH_DTYPE},
+    )
+
+EMBED_MODEL = _load_embed_model()
 
-# 2) Initialize a FAISS index (in-memory). Dimension = 384 for all-MiniLM-L6-v2
+# 2) Exact vector store for small corpora. Dimension = 384 for all-MiniLM-L6-v2
+#    Vectors are L2-normalized, so inner product == cosine similarity.
+#    Kept dimension-major (Fortran order: each dimension's values are
+#    contiguous across vectors), so a search is one BLAS matrix-vector
+#    product streaming through memory. Capacity doubles as it fills.
 EMBED_DIM = 384
-index = faiss.IndexFlatL2(EMBED_DIM)
+VECTOR_STORE_INITIAL_CAPACITY = 1024
+
+def _empty_vector_store(capacity: int = VECTOR_STORE_INITIAL_CAPACITY) -> np.ndarray:
+    return np.empty((capacity, EMBED_DIM), dtype=np.float32, order="F")
+
+_vectors = _empty_vector_store()
+_num_vectors = 0
+
+def _append_vectors(vectors: np.ndarray) -> None:
+    global _vectors, _num_vectors
+    needed = _num_vectors + len(vectors)
+    if needed > _vectors.shape[0]:
+        grown = _empty_vector_store(max(needed, 2 * _vectors.shape[0]))
+        grown[:_num_vectors] = _vectors[:_num_vectors]
+        _vectors = grown
+    _vectors[_num_vectors:needed] = vectors
+    _num_vectors = needed
+
+def _exact_search(q_vec: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brute-force inner product over the vector store.
+    Returns (scores, ids) for up to top_k vectors, best first.
+    """
+    # One BLAS call over the whole store: it already streams the
+    # dimension-major columns sequentially. Scoring in Python-level tiles
+    # (32..4096 vectors) measured slower at every size this store reaches.
+    scores = _vectors[:_num_vectors] @ q_vec[0]
+    if top_k < len(scores):
+        # O(N) partition, then sort only the top_k survivors
+        ids = np.argpartition(-scores, top_k)[:top_k]
+        ids = ids[np.argsort(-scores[ids])]
+    else:
+        ids = np.argsort(-scores)
+    return scores[ids], ids
+
+# 3) Once enough vectors exist to train it, the exact store is replaced by a
+#    compressed FAISS IVF index with 8-bit scalar-quantized vectors: 384 bytes
+#    per vector instead of 1.5 KB, scored with int8 SIMD kernels, typically
+#    <1% recall loss. Until then `index` is None.
+IVF_NLIST = 256
+IVF_NPROBE = 16
+IVF_TRAIN_SIZE = IVF_NLIST * 39  # FAISS wants ~39 training points per centroid
+
+index: Optional[faiss.Index] = None
+
+def vector_count() -> int:
+    return index.ntotal if index is not None else _num_vectors
+
+def _train_compressed_index(vectors: np.ndarray) -> faiss.Index:
+    vectors = np.ascontiguousarray(vectors)
+    quantizer = faiss.IndexFlatIP(EMBED_DIM)
+    compressed = faiss.IndexIVFScalarQuantizer(
+        quantizer, EMBED_DIM, IVF_NLIST, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+    )
+    compressed.train(vectors)
+    compressed.add(vectors)
+    compressed.nprobe = IVF_NPROBE
+    return compressed
+
+async def _maybe_compress_index() -> None:
+    """
+    Move the exact store into a trained IVF-SQ8 index once it holds
+    IVF_TRAIN_SIZE vectors. Training uses every vector added so far,
+    and ids are preserved because vectors are added in order.
+    Training runs in a worker thread; the caller holds the index lock,
+    so the store can't change until the new index is swapped in.
+    """
+    global index, _vectors, _num_vectors
+    if index is not None or _num_vectors < IVF_TRAIN_SIZE:
+        return
+    generation = _index_generation
+    compressed = await asyncio.to_thread(_train_compressed_index, _vectors[:_num_vectors])
+    if generation != _index_generation:
+        return  # clear_index() ran meanwhile
+    index = compressed
+    _vectors = _empty_vector_store(0)
+    _num_vectors = 0
+
+# 4) Metadata store: one row per stored chunk, pointing at its vector.
+#    Chunks with identical text share a vector, so several rows can map to
+#    the same vector id. The reverse mapping is first_row[vec_id] (-1 if no
+#    row uses it) plus shared_rows for the few vectors used by more rows.
+#    Kept as parallel columns instead of one dict per chunk; row dicts are
+#    only built when a result is read. The int columns are array('i'), which
+#    grows in place with amortized doubling, so appending an upload doesn't
+#    copy the whole corpus.
+@dataclass
+class MetaStore:
+    texts: List[str] = field(default_factory=list)
+    sources: List[str] = field(default_factory=list)
+    pages: array = field(default_factory=lambda: array("i"))
+    chunk_ids: array = field(default_factory=lambda: array("i"))
+    vec_ids: array = field(default_factory=lambda: array("i"))
+    first_row: array = field(default_factory=lambda: array("i"))
+    shared_rows: Dict[int, List[int]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return {
+            "text": self.texts[i],
+            "source": self.sources[i],
+            "page": self.pages[i],
+            "chunk_id": self.chunk_ids[i],
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
-# 3) Metadata store: list of (id → original text chunk)
-#    a Python list where index i corresponds to vector i.
-METADATA: List[Dict[str, Any]] = []
+    def extend(self, items: List[Dict[str, Any]], vec_ids: Optional[List[int]] = None) -> None:
+        """
+        Append rows; vec_ids[i] is the vector for items[i]. Defaults to each
+        item's "vec_id" (rows saved before deduplication: their row number).
+        """
+        start = len(self)
+        if vec_ids is None:
+            vec_ids = [item.get("vec_id", start + i) for i, item in enumerate(items)]
+        if vec_ids:
+            missing = max(vec_ids) + 1 - len(self.first_row)
+            if missing > 0:
+                self.first_row.extend(array("i", [-1]) * missing)
+        for row, vec_id in enumerate(vec_ids, start=start):
+            if self.first_row[vec_id] < 0:
+                self.first_row[vec_id] = row
+            else:
+                self.shared_rows.setdefault(vec_id, []).append(row)
+        self.vec_ids.extend(vec_ids)
+        self.texts.extend(item["text"] for item in items)
+        self.sources.extend(item["source"] for item in items)
+        self.pages.extend(item["page"] for item in items)
+        self.chunk_ids.extend(item["chunk_id"] for item in items)
 
+    def rows_for_vec(self, vec_id: int) -> List[int]:
+        if vec_id < 0 or vec_id >= len(self.first_row) or self.first_row[vec_id] < 0:
+            return []
+        return [self.first_row[vec_id]] + self.shared_rows.get(vec_id, [])
 
+    def referenced_vectors(self) -> int:
+        """Number of distinct vector ids used by at least one row."""
+        return len(np.unique(np.frombuffer(self.vec_ids, dtype=np.intc)))
+
+METADATA = MetaStore()
+
+# Text hash -> vector id, so repeated chunks (headers, footers, boilerplate)
+# are embedded and indexed once.
+_vec_id_by_hash: Dict[bytes, int] = {}
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# 5) Micro-batching: texts from concurrent uploads are merged into a single
+#    encoder call. The worker waits up to EMBED_BATCH_WINDOW_S after the first
+#    request for others to arrive, then fulfills each request's future.
+EMBED_BATCH_SIZE = 128 if DEVICE == "cuda" and EMBED_BACKEND == "torch" else 64
+EMBED_BATCH_WINDOW_S = 0.05
+EMBED_MAX_REQUESTS = 32
+
+_embed_queue: Optional[asyncio.Queue] = None
+_embed_worker: Optional[asyncio.Task] = None
+
+def start_embed_worker() -> None:
+    """
+    Start the background task that batches encoder calls.
+    Must be called from within the running event loop (e.g. app startup).
+    """
+    global _embed_queue, _embed_worker
+    _embed_queue = asyncio.Queue()
+    _embed_worker = asyncio.create_task(_run_embed_worker())
+
+async def stop_embed_worker() -> None:
+    """
+    Stop the batching worker. Requests still queued or being encoded fail
+    with RuntimeError instead of waiting forever.
+    """
+    global _embed_queue, _embed_worker
+    if _embed_worker is not None:
+        _embed_worker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _embed_worker
+    if _embed_queue is not None:
+        queued = []
+        while not _embed_queue.empty():
+            queued.append(_embed_queue.get_nowait())
+        _fail_requests(queued, RuntimeError("Embedding worker stopped."))
+    _embed_queue = None
+    _embed_worker = None
+
+def _fail_requests(requests: List[Tuple[List[str], asyncio.Future]], exc: BaseException) -> None:
+    for _, future in requests:
+        if not future.done():
+            future.set_exception(exc)
+
+async def _run_embed_worker() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await _embed_queue.get()]
+        try:
+            deadline = loop.time() + EMBED_BATCH_WINDOW_S
+            while len(pending) < EMBED_MAX_REQUESTS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(_embed_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            all_texts = [text for texts, _ in pending for text in texts]
+            vectors = await asyncio.to_thread(
+                EMBED_MODEL.encode,
+                all_texts,
+                batch_size=EMBED_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        except asyncio.CancelledError:
+            _fail_requests(pending, RuntimeError("Embedding worker stopped."))
+            raise
+        except Exception as e:
+            _fail_requests(pending, e)
+            continue
+
+        offset = 0
+        for texts, future in pending:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+async def submit_embed(texts: List[str]) -> np.ndarray:
+    """
+    Queue `texts` for the batching worker and wait for their
+    (normalized) embeddings, returned in the same order.
+    """
+    if _embed_queue is None:
+        start_embed_worker()
+    future = asyncio.get_running_loop().create_future()
+    await _embed_queue.put((texts, future))
+    return await future
+
+
+# 6) Persistence: metadata rows are appended to a JSONL file as they are
+#    stored; the index is checkpointed in the background (and once more on
+#    shutdown) after INDEX_SAVE_EVERY new vectors, or 1/INDEX_SAVE_GROWTH of
+#    the index if that is more, so total checkpoint I/O grows linearly.
 INDEX_PATH = "index.faiss"
-META_PATH  = "metadata.json"
+META_PATH  = "metadata.jsonl"
+LEGACY_META_PATH = "metadata.json"  # written by earlier versions; migrated on load
+INDEX_SAVE_EVERY = 256
+INDEX_SAVE_GROWTH = 10
+
+_unsaved_vectors = 0
+_index_generation = 0
+_checkpoint_task: Optional[asyncio.Task] = None
+_index_lock: Optional[asyncio.Lock] = None
+# Held across the generation check + replace of a checkpoint and across
+# clear_index()'s generation bump + file removal, so a stale checkpoint can
+# never land after the files were cleared.
+_index_file_lock = threading.Lock()
+
+def _get_index_lock() -> asyncio.Lock:
+    """
+    Lock held while the vector store is modified or snapshotted.
+    Created lazily so it belongs to the server's event loop.
+    """
+    global _index_lock
+    if _index_lock is None:
+        _index_lock = asyncio.Lock()
+    return _index_lock
+
+def _write_file_atomic(path: str, data) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+def _write_index_checkpoint(data: np.ndarray, generation: int) -> None:
+    # clear_index() may have run since the snapshot was taken
+    with _index_file_lock:
+        if generation != _index_generation:
+            return
+        _write_file_atomic(INDEX_PATH, data)
+
+def _serialize_index(store_index: Optional[faiss.Index], vectors: np.ndarray, num_vectors: int) -> np.ndarray:
+    # The exact store is saved as a flat FAISS index so there is one file format
+    if store_index is not None:
+        return faiss.serialize_index(store_index)
+    flat = faiss.IndexFlatIP(EMBED_DIM)
+    flat.add(np.ascontiguousarray(vectors[:num_vectors]))
+    return faiss.serialize_index(flat)
+
+async def _snapshot_index() -> np.ndarray:
+    """
+    Serialize the current store from a worker thread; the index lock keeps
+    uploads from modifying it meanwhile without blocking the event loop.
+    """
+    async with _get_index_lock():
+        return await asyncio.to_thread(_serialize_index, index, _vectors, _num_vectors)
+
+async def _checkpoint_index(generation: int) -> None:
+    try:
+        data = await _snapshot_index()
+        await asyncio.to_thread(_write_index_checkpoint, data, generation)
+    except Exception:
+        logger.exception("Failed to checkpoint FAISS index")
+
+def _schedule_index_checkpoint() -> None:
+    """
+    Snapshot and write the index in the background, so the caller doesn't
+    wait on serialization or disk I/O. At most one checkpoint is in flight;
+    later additions are picked up by the next.
+    """
+    global _checkpoint_task, _unsaved_vectors
+    if _checkpoint_task is not None and not _checkpoint_task.done():
+        return
+    _unsaved_vectors = 0
+    _checkpoint_task = asyncio.create_task(_checkpoint_index(_index_generation))
+
+def append_metadata(items: List[Dict[str, Any]], vec_ids: List[int]) -> None:
+    """
+    Append one JSON line per item to META_PATH.
+    """
+    lines = b"".join(
+        orjson.dumps(
+            {
+                "text": item["text"],
+                "source": item["source"],
+                "page": item["page"],
+                "chunk_id": item["chunk_id"],
+                "vec_id": vec_id,
+            },
+            option=orjson.OPT_APPEND_NEWLINE,
+        )
+        for item, vec_id in zip(items, vec_ids)
+    )
+    with open(META_PATH, "ab", buffering=0) as f:
+        end = f.tell()
+        try:
+            view = memoryview(lines)
+            while view:
+                view = view[f.write(view):]
+        except BaseException:
+            # Don't leave part of the batch behind: those rows would point
+            # at vector ids the next upload reuses for other texts
+            with contextlib.suppress(OSError):
+                f.truncate(end)
+            raise
 
 def clear_index(delete_files: bool = True):
     """
     Reset the in-memory FAISS index and metadata.
     Optionally delete persistence files on disk.
     """
-    global index, METADATA
-    # Recreate empty index
-    new_index = faiss.IndexFlatL2(EMBED_DIM)
-    index = new_index
-    METADATA = []
+    global index, METADATA, _vectors, _num_vectors, _vec_id_by_hash, _unsaved_vectors, _index_generation
+    # Recreate empty store
+    index = None
+    _vectors = _empty_vector_store()
+    _num_vectors = 0
+    METADATA = MetaStore()
+    _vec_id_by_hash = {}
+    _unsaved_vectors = 0
 
-    if delete_files:
-        for p in (INDEX_PATH, META_PATH):
-            try:
-                if os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
+    with _index_file_lock:
+        _index_generation += 1
+        if delete_files:
+            for p in (INDEX_PATH, META_PATH):
+                try:
+                    if os.path.exists(p):
+                        os.remove(p)
+                except Exception:
+                    pass
 
-def embed_and_store(items: List[Dict[str, Any]]) -> None:
+async def embed_and_store(items: List[Dict[str, Any]]) -> None:
     """
     items: [
       {"text": "...", "source": filename, "page": page_num, "chunk_id": id},
       ...
     ]
-    Embeds each `item["text"]` and appends the full item dict to METADATA.
+    Embeds each distinct, not-yet-stored `item["text"]` and appends every
+    item's fields to METADATA; repeated texts reuse the existing vector.
     """
-    # 1) Extract just the texts in order
-    texts = [item["text"] for item in items]
+    generation = _index_generation
+
+    # 1) Pick out the texts that still need a vector (first occurrence only)
+    keys = [_text_key(item["text"]) for item in items]
+    new_texts: Dict[bytes, str] = {}
+    for key, item in zip(keys, items):
+        if key not in _vec_id_by_hash and key not in new_texts:
+            new_texts[key] = item["text"]
+
+    global _unsaved_vectors
+    vectors = None
+    if new_texts:
+        # 2) Compute embeddings (batched with any concurrent uploads)
+        #    encode() already returns a float32 numpy array, so this is a no-copy
+        #    view unless the dtype/layout actually needs fixing.
+        vectors = np.ascontiguousarray(await submit_embed(list(new_texts.values())), dtype=np.float32)
 
-    # 2) Compute embeddings
-    vectors = EMBED_MODEL.encode(texts, show_progress_bar=False)
-    vectors = np.array(vectors).astype("float32")
+    # Uploads and index snapshots take this lock, so they never interleave;
+    # the only await inside is IVF training, after the store is consistent.
+    async with _get_index_lock():
+        if generation != _index_generation:
+            raise RuntimeError("Index was cleared during the upload; please retry.")
+        # 3) Assign ids to the texts no concurrent upload has stored meanwhile
+        new_ids: Dict[bytes, int] = {}
+        if vectors is not None:
+            fresh = [i for i, key in enumerate(new_texts) if key not in _vec_id_by_hash]
+            if len(fresh) < len(new_texts):
+                vectors = vectors[fresh]
+            new_keys = list(new_texts)
+            first_id = vector_count()
+            new_ids = {new_keys[i]: first_id + offset for offset, i in enumerate(fresh)}
+        vec_ids = [_vec_id_by_hash[key] if key in _vec_id_by_hash else new_ids[key] for key in keys]
 
-    # 3) Add to FAISS and record metadata
-    index.add(vectors)
-    METADATA.extend(items)
+        # 4) Persist the metadata rows first: if that fails, nothing in memory
+        #    has changed and no checkpoint can save vectors without rows.
+        append_metadata(items, vec_ids)
 
+        # 5) Add vectors and rows; the index is saved in the background
+        _vec_id_by_hash.update(new_ids)
+        if new_ids:
+            if index is None:
+                _append_vectors(vectors)
+            else:
+                index.add(vectors)
+            _unsaved_vectors += len(vectors)
+        METADATA.extend(items, vec_ids)
+        await _maybe_compress_index()
+        if _unsaved_vectors >= max(INDEX_SAVE_EVERY, vector_count() // INDEX_SAVE_GROWTH):
+            _schedule_index_checkpoint()
+
+
+QUERY_CACHE_SIZE = 512
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _encode_query(query: str) -> bytes:
+    """
+    Normalized float32 embedding of an already-normalized query string.
+    Cached as immutable bytes so repeated queries skip the encoder.
+    """
+    vec = EMBED_MODEL.encode(
+        [query], convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+    )
+    return np.ascontiguousarray(vec, dtype=np.float32).tobytes()
 
 def search(query: str, top_k: int = 5) -> List[Tuple[str, float]]:
     """
-    Given a query string, return up to top_k (chunk_text, score) tuples.
+    Given a query string, return up to top_k (chunk_text, score) tuples,
+    best first. Score is cosine similarity (higher = better match).
+    Chunks sharing a vector are returned together with the same score.
     Bad indices (e.g. -1 or out of range) are skipped.
     """
-    q_vec = EMBED_MODEL.encode([query]).astype("float32")
-    distances, indices = index.search(q_vec, top_k)
+    # all-MiniLM-L6-v2 is uncased, so case/whitespace folding doesn't change the vector
+    cache_key = " ".join(query.split()).lower()
+    q_vec = np.frombuffer(_encode_query(cache_key), dtype=np.float32).reshape(1, EMBED_DIM)
+    if index is None:
+        scores, indices = _exact_search(q_vec, top_k)
+    else:
+        scores, indices = index.search(q_vec, top_k)
+        scores, indices = scores[0], indices[0]
 
     results: List[Tuple[str, float]] = []
-    for dist, idx in zip(distances[0], indices[0]):
-        # Skip invalid indices
-        if idx < 0 or idx >= len(METADATA):
-            continue
-        results.append((METADATA[idx], float(dist)))
+    for score, vec_id in zip(scores, indices):
+        # Invalid indices (e.g. -1) have no rows and are skipped
+        for row in METADATA.rows_for_vec(int(vec_id)):
+            results.append((METADATA[row], float(score)))
+            if len(results) == top_k:
+                return results
     return results
 
-def save_index_and_metadata():
-    # 1) Save FAISS index
-    faiss.write_index(index, INDEX_PATH)
-    # 2) Save METADATA
-    with open(META_PATH, "w", encoding="utf-8") as f:
-        json.dump(METADATA, f, ensure_ascii=False, indent=2)
+async def save_index_and_metadata():
+    """
+    Write the full index to disk, after any in-flight checkpoint.
+    Metadata is already on disk (appended as rows are stored).
+    """
+    if _checkpoint_task is not None:
+        await _checkpoint_task
+    generation = _index_generation
+    data = await _snapshot_index()
+    await asyncio.to_thread(_write_index_checkpoint, data, generation)
+
+def _migrate_legacy_metadata() -> None:
+    """
+    Convert a metadata.json from earlier versions (a list of row dicts, or
+    the {"texts": [...], "sources": [...], ...} column layout) into
+    META_PATH once, then remove it.
+    """
+    if os.path.exists(META_PATH) or not os.path.exists(LEGACY_META_PATH):
+        return
+    with open(LEGACY_META_PATH, "rb") as f:
+        data = orjson.loads(f.read())
+    if isinstance(data, dict):
+        data = [
+            {"text": t, "source": src, "page": p, "chunk_id": c}
+            for t, src, p, c in zip(data["texts"], data["sources"], data["pages"], data["chunk_ids"])
+        ]
+    # rows predate deduplication: row i uses vector i
+    _write_file_atomic(META_PATH, b"".join(
+        orjson.dumps({**row, "vec_id": i}, option=orjson.OPT_APPEND_NEWLINE)
+        for i, row in enumerate(data)
+    ))
+    os.remove(LEGACY_META_PATH)
+    logger.info("Migrated %d metadata rows from %s to %s", len(data), LEGACY_META_PATH, META_PATH)
 
 def load_index_and_metadata():
     global index, METADATA
-    # 1) Load FAISS index if present
+    clear_index(delete_files=False)
+    _migrate_legacy_metadata()
+    # 1) Load FAISS index if present; anything but a trained IVF index
+    #    (i.e. a saved exact store) goes back into the vector store
     if os.path.exists(INDEX_PATH):
-        index = faiss.read_index(INDEX_PATH)
-    # 2) Load METADATA if present
+        loaded = faiss.read_index(INDEX_PATH)
+        if isinstance(loaded, faiss.IndexIVF):
+            index = loaded
+        elif loaded.ntotal > 0:
+            _append_vectors(loaded.reconstruct_n(0, loaded.ntotal))
+    # 2) Stream METADATA rows if present
+    rows: List[Dict[str, Any]] = []
+    torn_tail = False
     if os.path.exists(META_PATH):
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            METADATA = json.load(f)
\ No newline at end of file
+        with open(META_PATH, "rb") as f:
+            lines = [line for line in f if line.strip()]
+        # A crash during append_metadata() can leave the last line half-written
+        if lines:
+            try:
+                if not lines[-1].endswith(b"\n"):
+                    raise ValueError("missing newline")
+                orjson.loads(lines[-1])
+            except ValueError:
+                logger.warning("Dropping truncated last line of %s", META_PATH)
+                lines.pop()
+                torn_tail = True
+        rows = [orjson.loads(line) for line in lines]
+
+    # 3) Reconcile: rows appended after the last index checkpoint may point
+    #    at vectors that never reached disk; drop them (and rewrite the file).
+    for i, row in enumerate(rows):
+        row.setdefault("vec_id", i)  # rows saved before deduplication
+    num_saved = vector_count()
+    kept = [row for row in rows if row["vec_id"] < num_saved]
+    if len(kept) < len(rows) or torn_tail:
+        if len(kept) < len(rows):
+            logger.warning(
+                "Dropping %d metadata rows newer than the saved index", len(rows) - len(kept)
+            )
+        rows = kept
+        _write_file_atomic(META_PATH, b"".join(
+            orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows
+        ))
+    METADATA = MetaStore()
+    METADATA.extend(rows)
+
+    # 4) Saved vectors that no row uses are harmless (search skips them), but
+    #    point at a lost metadata write; keep the data and report it.
+    orphans = num_saved - METADATA.referenced_vectors()
+    if orphans > 0:
+        logger.warning("Saved index has %d vectors without metadata rows", orphans)
+    for row in rows:
+        _vec_id_by_hash.setdefault(_text_key(row["text"]), row["vec_id"])
@@ -1,5 +1,6 @@
 import os
-import shutil
+import asyncio
+import aiofiles
 import app.embeddings as embeddings
 import openai
 import logging
@@ -8,13 +9,14 @@ from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from app.models import UploadResponse, QueryRequest, QueryResponse, ErrorResponse
-from app.utils import extract_pdf_chunks
+from app.utils import extract_pdf_chunks, shutdown_pool
 from app.embeddings import embed_and_store, load_index_and_metadata, save_index_and_metadata, search
 from app.qa import answer_with_qa
 from typing import List, Optional
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 MAX_UPLOAD_BYTES = 25 * 1024 * 1024  # 25 MB
+UPLOAD_CHUNK_BYTES = 1024 * 1024  # 1 MB per read/write while saving uploads
 
 logging.basicConfig(
     level=logging.INFO,
@@ -40,10 +42,13 @@ app.add_middleware(
 @app.on_event("startup")
 async def on_startup():
     load_index_and_metadata()
+    embeddings.start_embed_worker()
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    save_index_and_metadata()
+    await embeddings.stop_embed_worker()
+    await save_index_and_metadata()
+    await asyncio.to_thread(shutdown_pool)
     
 @app.get("/")
 async def root():
@@ -88,15 +93,18 @@ async def upload_pdf(file: UploadFile = File(...)):
 
     temp_path = os.path.join(UPLOAD_DIR, file.filename)
     try:
-        with open(temp_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        # stream in chunks without blocking the event loop
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                await f.write(chunk)
     except Exception as e:
         logger.exception("Failed to write upload")
         raise HTTPException(status_code=500, detail=f"Failed to save upload: {e}")
 
     # Extract & chunk with metadata
     try:
-        items = extract_pdf_chunks(temp_path, source=file.filename, max_chars=800)
+        # CPU-bound; keep the event loop (and the embedding batcher) responsive
+        items = await asyncio.to_thread(extract_pdf_chunks, temp_path, source=file.filename, max_chars=800)
     except Exception as e:
         os.remove(temp_path)
         logger.exception("PDF extraction failed")
@@ -111,7 +119,7 @@ async def upload_pdf(file: UploadFile = File(...)):
 
     # Embed & store
     try:
-        embed_and_store(items)
+        await embed_and_store(items)
     except Exception as e:
         logger.exception("Embedding error")
         os.remove(temp_path)
@@ -134,7 +142,7 @@ async def search_docs(
     Returns up to top_k most similar chunks, including full metadata.
     """
     # Empty index guard
-    if len(embeddings.METADATA) == 0 or embeddings.index.ntotal == 0:
+    if len(embeddings.METADATA) == 0 or embeddings.vector_count() == 0:
         return JSONResponse(
             status_code=200,
             content={"results": [], "message": "Index is empty. Upload a PDF first."}
@@ -155,7 +163,7 @@ async def search_docs(
 @app.post("/query", response_model=QueryResponse, responses={200: {"model": QueryResponse}, 400: {"model": ErrorResponse}})
 async def query_docs(req: QueryRequest):
     # Empty index guard
-    if len(embeddings.METADATA) == 0 or embeddings.index.ntotal == 0:
+    if len(embeddings.METADATA) == 0 or embeddings.vector_count() == 0:
         return JSONResponse(
             status_code=400,
             content=ErrorResponse(error="empty_index", detail="No documents indexed. Upload a PDF first.").model_dump()
@@ -192,22 +200,22 @@ async def query_docs(req: QueryRequest):
         logger.exception("QA pipeline error")
         return QueryResponse(answer=f"QA error: {e}", sources=sources)
 
-    # Optional: confidence gate
-    if not answer_text:
-        answer_text = "I don’t know."
-
-    # (Optional) find citation offsets
+    # Citation offsets: the QA model reports them in context coordinates,
+    # and the context is sources[0]["text"]
     which = None
-    idx = sources[0]["text"].find(answer_text) if sources else -1
-    if idx != -1 and sources:
+    if answer_text:
         which = {
             "source": sources[0]["source"],
             "page": sources[0]["page"],
             "chunk_id": sources[0]["chunk_id"],
-            "start": idx,
-            "end": idx + len(answer_text),
+            "start": int(qa_res["start"]),
+            "end": int(qa_res["end"]),
         }
 
+    # Optional: confidence gate
+    if not answer_text:
+        answer_text = "I don’t know."
+
     return QueryResponse(answer=answer_text, sources=sources, confidence=conf, citation=which)
 
 
@@ -216,7 +224,7 @@ async def query_docs(req: QueryRequest):
 async def stats():
     try:
         return {
-            "vector_count": embeddings.index.ntotal,
+            "vector_count": embeddings.vector_count(),
             "metadata_count": len(embeddings.METADATA)
         }
     except Exception as e:
@@ -238,7 +246,7 @@ async def clear_index_route(x_admin_token: Optional[str] = Header(None)):
     embeddings.clear_index(delete_files=True)
     return {
         "message": "Index cleared.",
-        "vector_count": embeddings.index.ntotal,
+        "vector_count": embeddings.vector_count(),
         "metadata_count": len(embeddings.METADATA),
     }
 
@@ -246,6 +254,6 @@ async def clear_index_route(x_admin_token: Optional[str] = Header(None)):
 async def list_sources():
     # Unique filenames with counts
     from collections import Counter
-    names = [m.get("source") for m in embeddings.METADATA if m.get("source")]
+    names = [s for s in embeddings.METADATA.sources if s]
     counts = Counter(names)
     return [{"source": k, "count": v} for k, v in sorted(counts.items())]
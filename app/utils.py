@@ -1,5 +1,49 @@
+import os
+import multiprocessing
+import threading
 import pdfplumber
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional
+
+# Each worker task re-opens the PDF (about one page's worth of work), so a
+# task gets at least PAGES_PER_WORKER pages, and smaller PDFs stay serial.
+PAGES_PER_WORKER = 4
+PARALLEL_MIN_PAGES = 2 * PAGES_PER_WORKER
+
+# One spawn pool shared by all uploads, started on first use: spawned
+# interpreters are too slow to start per upload, and concurrent uploads
+# must not each start cpu_count processes.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process runs ONNX/torch and encoder threads
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    # A worker died; the next upload starts a fresh pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+def shutdown_pool() -> None:
+    """
+    Stop the extraction worker processes, if they were started.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
 
 def extract_text_from_pdf(path: str) -> str:
     """
@@ -24,6 +68,8 @@ def chunk_text(text: str, max_chars: int = 800) -> List[str]:
         end = start + max_chars
         if end < length:
             # try to split at nearest newline or space
+            # (rfind is bounded to this window, so the whole loop stays linear;
+            # precomputing every boundary position up front measured slower)
             split_pos = text.rfind("\n", start, end)
             if split_pos == -1:
                 split_pos = text.rfind(" ", start, end)
@@ -37,6 +83,25 @@ def chunk_text(text: str, max_chars: int = 800) -> List[str]:
         start = split_pos
     return chunks
 
+def _page_items(page, page_num: int, max_chars: int, source: str) -> List[Dict[str, Any]]:
+    # `chunk_id` is assigned by the caller once all pages are gathered
+    raw = page.extract_text() or ""
+    return [
+        {"text": chunk, "source": source, "page": page_num}
+        for chunk in chunk_text(raw, max_chars)
+    ]
+
+def _extract_page_range(path: str, first_page: int, last_page: int, max_chars: int, source: str) -> List[Dict[str, Any]]:
+    """
+    Extract and chunk pages first_page..last_page (1-based, inclusive).
+    Opens the PDF once itself so it can run in a worker process.
+    """
+    items: List[Dict[str, Any]] = []
+    with pdfplumber.open(path) as pdf:
+        for page_num in range(first_page, last_page + 1):
+            items.extend(_page_items(pdf.pages[page_num - 1], page_num, max_chars, source))
+    return items
+
 def extract_pdf_chunks(
     path: str,
     source: str,
@@ -51,22 +116,40 @@ def extract_pdf_chunks(
         "page": <page number>,
         "chunk_id": <sequential ID within this document>
       }
+    Larger PDFs are split into one contiguous page range per worker process.
+    This is blocking; call it from a thread when inside the event loop.
     """
-    items: List[Dict[str, Any]] = []
-    chunk_id = 0
-
     with pdfplumber.open(path) as pdf:
-        for page_num, page in enumerate(pdf.pages, start=1):
-            raw = page.extract_text() or ""
-            # reuse your chunk_text() to split the page’s raw text
-            page_chunks = chunk_text(raw, max_chars)
-            for chunk in page_chunks:
-                items.append({
-                    "text": chunk,
-                    "source": source,
-                    "page": page_num,
-                    "chunk_id": chunk_id
-                })
-                chunk_id += 1
+        num_pages = len(pdf.pages)
+        workers = min(os.cpu_count() or 1, num_pages // PAGES_PER_WORKER)
+        if num_pages < PARALLEL_MIN_PAGES or workers < 2:
+            ranges = [
+                _page_items(page, page_num, max_chars, source)
+                for page_num, page in enumerate(pdf.pages, start=1)
+            ]
+        else:
+            ranges = None
 
-    return items
\ No newline at end of file
+    if ranges is None:
+        bounds = [num_pages * w // workers for w in range(workers + 1)]
+        pool = _get_pool()
+        try:
+            ranges = list(pool.map(
+                _extract_page_range,
+                [path] * workers,
+                [bounds[w] + 1 for w in range(workers)],
+                [bounds[w + 1] for w in range(workers)],
+                [max_chars] * workers,
+                [source] * workers,
+            ))
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+
+    # Assign chunk ids after the gather so they follow page order
+    items: List[Dict[str, Any]] = []
+    for range_items in ranges:
+        for item in range_items:
+            item["chunk_id"] = len(items)
+            items.append(item)
+    return items
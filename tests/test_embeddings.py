@@ -0,0 +1,300 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+import app.embeddings as embeddings
+
+
+@pytest.fixture
+def store_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "INDEX_PATH", str(tmp_path / "index.faiss"))
+    monkeypatch.setattr(embeddings, "META_PATH", str(tmp_path / "metadata.jsonl"))
+    monkeypatch.setattr(embeddings, "LEGACY_META_PATH", str(tmp_path / "metadata.json"))
+    # each test runs its own event loop
+    monkeypatch.setattr(embeddings, "_index_lock", None)
+    monkeypatch.setattr(embeddings, "_checkpoint_task", None)
+    monkeypatch.setattr(embeddings, "submit_embed", _fake_embed)
+    monkeypatch.setattr(embeddings, "EMBED_MODEL", SimpleNamespace(encode=_fake_vectors))
+    embeddings._encode_query.cache_clear()
+    yield tmp_path
+    embeddings.clear_index(delete_files=False)
+
+
+def _write_index(path, n):
+    vectors = np.random.default_rng(0).random((n, embeddings.EMBED_DIM), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    flat = faiss.IndexFlatIP(embeddings.EMBED_DIM)
+    flat.add(vectors)
+    faiss.write_index(flat, str(path))
+
+
+def _write_rows(path, vec_ids):
+    with open(path, "wb") as f:
+        for i, vec_id in enumerate(vec_ids):
+            row = {"text": f"chunk {vec_id}", "source": "a.pdf", "page": 1, "chunk_id": i, "vec_id": vec_id}
+            f.write(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+
+
+def _fake_vectors(texts, **kwargs):
+    # Deterministic unit vectors; distinct texts get distinct vectors
+    seeds = [int.from_bytes(embeddings._text_key(text)[:4], "little") for text in texts]
+    vectors = np.stack([
+        np.random.default_rng(seed).random(embeddings.EMBED_DIM, dtype=np.float32) for seed in seeds
+    ])
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+async def _fake_embed(texts):
+    return _fake_vectors(texts)
+
+
+def _items(texts, source="a.pdf"):
+    return [{"text": t, "source": source, "page": 1, "chunk_id": i} for i, t in enumerate(texts)]
+
+
+def test_load_keeps_consistent_store(store_paths):
+    _write_index(store_paths / "index.faiss", 2)
+    _write_rows(store_paths / "metadata.jsonl", [0, 1, 0])
+
+    embeddings.load_index_and_metadata()
+
+    assert embeddings.vector_count() == 2
+    assert len(embeddings.METADATA) == 3
+    assert embeddings.METADATA.rows_for_vec(0) == [0, 2]
+
+
+def test_load_drops_rows_newer_than_index(store_paths):
+    _write_index(store_paths / "index.faiss", 2)
+    _write_rows(store_paths / "metadata.jsonl", [0, 1, 2, 0])
+
+    embeddings.load_index_and_metadata()
+
+    assert embeddings.vector_count() == 2
+    assert [row["chunk_id"] for row in embeddings.METADATA] == [0, 1, 3]
+    with open(store_paths / "metadata.jsonl", "rb") as f:
+        assert len(f.readlines()) == 3
+
+
+def test_load_drops_truncated_last_line(store_paths):
+    _write_index(store_paths / "index.faiss", 2)
+    _write_rows(store_paths / "metadata.jsonl", [0, 1])
+    with open(store_paths / "metadata.jsonl", "ab") as f:
+        f.write(b'{"text": "chunk 0", "sour')
+
+    embeddings.load_index_and_metadata()
+
+    assert [row["chunk_id"] for row in embeddings.METADATA] == [0, 1]
+    with open(store_paths / "metadata.jsonl", "rb") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_load_keeps_vectors_without_rows(store_paths):
+    _write_index(store_paths / "index.faiss", 3)
+    _write_rows(store_paths / "metadata.jsonl", [0, 1])
+
+    embeddings.load_index_and_metadata()
+
+    assert embeddings.vector_count() == 3
+    assert len(embeddings.METADATA) == 2
+    assert embeddings.METADATA.rows_for_vec(2) == []
+    assert (store_paths / "index.faiss").exists()
+    assert (store_paths / "metadata.jsonl").exists()
+
+
+def test_load_migrates_legacy_metadata_json(store_paths):
+    _write_index(store_paths / "index.faiss", 2)
+    legacy = [
+        {"text": "first", "source": "a.pdf", "page": 1, "chunk_id": 0},
+        {"text": "second", "source": "a.pdf", "page": 2, "chunk_id": 1},
+    ]
+    with open(store_paths / "metadata.json", "wb") as f:
+        f.write(orjson.dumps(legacy))
+
+    embeddings.load_index_and_metadata()
+
+    assert list(embeddings.METADATA) == legacy
+    assert embeddings.METADATA.rows_for_vec(1) == [1]
+    assert (store_paths / "metadata.jsonl").exists()
+    assert not (store_paths / "metadata.json").exists()
+
+
+def test_stale_checkpoint_is_not_written_after_clear(store_paths):
+    generation = embeddings._index_generation
+    embeddings.clear_index(delete_files=True)
+
+    embeddings._write_index_checkpoint(b"stale", generation)
+
+    assert not (store_paths / "index.faiss").exists()
+
+
+def test_failed_metadata_append_leaves_store_unchanged(store_paths, monkeypatch):
+
+    def fail_append(items, vec_ids):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(embeddings, "append_metadata", fail_append)
+    with pytest.raises(OSError):
+        asyncio.run(embeddings.embed_and_store(_items(["a", "b"])))
+
+    assert embeddings.vector_count() == 0
+    assert len(embeddings.METADATA) == 0
+    assert embeddings._vec_id_by_hash == {}
+
+
+def test_compression_trains_off_the_event_loop(store_paths, monkeypatch):
+    monkeypatch.setattr(embeddings, "IVF_NLIST", 4)
+    monkeypatch.setattr(embeddings, "IVF_TRAIN_SIZE", 4 * 39)
+    train = embeddings._train_compressed_index
+    threads = []
+
+    def spy(vectors):
+        threads.append(threading.current_thread())
+        return train(vectors)
+
+    monkeypatch.setattr(embeddings, "_train_compressed_index", spy)
+    asyncio.run(embeddings.embed_and_store(_items([f"text {i}" for i in range(200)])))
+
+    assert threads and threads[0] is not threading.main_thread()
+    assert isinstance(embeddings.index, faiss.IndexIVFScalarQuantizer)
+    assert embeddings.vector_count() == 200
+    assert len(embeddings.METADATA) == 200
+
+
+def test_repeated_texts_share_one_vector(store_paths):
+    asyncio.run(embeddings.embed_and_store(_items(["header", "body 1", "header"])))
+    asyncio.run(embeddings.embed_and_store(_items(["header", "body 2"], source="b.pdf")))
+
+    assert embeddings.vector_count() == 3
+    assert len(embeddings.METADATA) == 5
+    assert embeddings.METADATA.rows_for_vec(0) == [0, 2, 3]
+    with open(store_paths / "metadata.jsonl", "rb") as f:
+        assert [orjson.loads(line)["vec_id"] for line in f] == [0, 1, 0, 0, 2]
+
+
+def test_text_stored_during_encode_is_not_added_twice(store_paths, monkeypatch):
+    async def embed_with_concurrent_upload(texts):
+        # Another upload stores "shared" while this one is being encoded
+        monkeypatch.setattr(embeddings, "submit_embed", _fake_embed)
+        await embeddings.embed_and_store(_items(["shared"], source="b.pdf"))
+        return _fake_vectors(texts)
+
+    monkeypatch.setattr(embeddings, "submit_embed", embed_with_concurrent_upload)
+    asyncio.run(embeddings.embed_and_store(_items(["shared", "only a"])))
+
+    assert embeddings.vector_count() == 2
+    assert embeddings.METADATA.sources == ["b.pdf", "a.pdf", "a.pdf"]
+    assert embeddings.METADATA.rows_for_vec(0) == [0, 1]
+    assert embeddings.METADATA.rows_for_vec(1) == [2]
+
+
+def test_search_expands_shared_vectors_up_to_top_k(store_paths):
+    asyncio.run(embeddings.embed_and_store(_items(["footer", "intro", "footer", "footer", "summary"])))
+
+    results = embeddings.search("  FOOTER ", top_k=2)
+
+    assert [row["chunk_id"] for row, _ in results] == [0, 2]
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert results[0][1] == results[1][1]
+
+    results = embeddings.search("intro", top_k=10)
+    assert len(results) == 5
+    assert results[0][0]["text"] == "intro"
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_exact_search_returns_best_first(store_paths):
+    vectors = np.random.default_rng(1).random((1000, embeddings.EMBED_DIM), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    embeddings._append_vectors(vectors)
+    q_vec = vectors[:1]
+    expected = np.sort(embeddings._vectors[:1000] @ q_vec[0])[::-1]
+
+    scores, ids = embeddings._exact_search(q_vec, 10)
+    assert ids[0] == 0
+    np.testing.assert_allclose(scores, expected[:10], rtol=1e-6)
+    np.testing.assert_array_equal(scores, (embeddings._vectors[:1000] @ q_vec[0])[ids])
+
+    scores, ids = embeddings._exact_search(q_vec, 5000)
+    assert len(ids) == 1000
+    np.testing.assert_allclose(scores, expected, rtol=1e-6)
+
+
+@pytest.fixture
+def embed_worker(monkeypatch):
+    monkeypatch.setattr(embeddings, "_embed_queue", None)
+    monkeypatch.setattr(embeddings, "_embed_worker", None)
+    calls = []
+
+    def encode(texts, **kwargs):
+        calls.append(list(texts))
+        return _fake_vectors(texts)
+
+    monkeypatch.setattr(embeddings, "EMBED_MODEL", SimpleNamespace(encode=encode))
+    return calls
+
+
+def test_worker_merges_concurrent_requests(embed_worker):
+    requests = [["a", "b"], ["c"], ["d", "e", "f"]]
+
+    async def run():
+        try:
+            return await asyncio.gather(*(embeddings.submit_embed(texts) for texts in requests))
+        finally:
+            await embeddings.stop_embed_worker()
+
+    results = asyncio.run(run())
+
+    assert embed_worker == [["a", "b", "c", "d", "e", "f"]]
+    for texts, vectors in zip(requests, results):
+        np.testing.assert_array_equal(vectors, _fake_vectors(texts))
+
+
+def test_worker_fails_every_request_in_a_failed_batch(monkeypatch, embed_worker):
+    def encode(texts, **kwargs):
+        raise ValueError("encoder failed")
+
+    monkeypatch.setattr(embeddings, "EMBED_MODEL", SimpleNamespace(encode=encode))
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                embeddings.submit_embed(["a"]), embeddings.submit_embed(["b"]), return_exceptions=True
+            )
+        finally:
+            await embeddings.stop_embed_worker()
+
+    results = asyncio.run(run())
+
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+
+def test_stop_fails_queued_and_in_flight_requests(monkeypatch, embed_worker):
+    started = threading.Event()
+    release = threading.Event()
+
+    def encode(texts, **kwargs):
+        started.set()
+        release.wait(5)
+        return _fake_vectors(texts)
+
+    monkeypatch.setattr(embeddings, "EMBED_MODEL", SimpleNamespace(encode=encode))
+    monkeypatch.setattr(embeddings, "EMBED_MAX_REQUESTS", 1)
+
+    async def run():
+        tasks = [asyncio.create_task(embeddings.submit_embed([f"t{i}"])) for i in range(3)]
+        await asyncio.to_thread(started.wait, 5)
+        await embeddings.stop_embed_worker()
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 5)
+
+    results = asyncio.run(run())
+
+    assert [type(r) for r in results] == [RuntimeError] * 3